@@ -5,27 +5,50 @@ Fetches Google Calendar events and publishes to IoT Core
 
 import json
 import os
+import time
 import boto3
-from datetime import datetime, timedelta
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+# Google API libraries are imported inside the functions that use them so a
+# failed warm-up (see get_calendar_service) never prevents the module loading
 
 # Environment variables
 THING_NAME = os.environ['THING_NAME']
 CALENDAR_ID = os.environ.get('CALENDAR_ID', 'primary')
 IOT_ENDPOINT = os.environ.get('IOT_ENDPOINT', '')
+DEBUG = os.environ.get('LOG_LEVEL') == 'DEBUG'  # Log full payloads
 
 # Google OAuth credentials from environment
 GOOGLE_CLIENT_ID = os.environ['GOOGLE_CLIENT_ID']
 GOOGLE_CLIENT_SECRET = os.environ['GOOGLE_CLIENT_SECRET']
 GOOGLE_REFRESH_TOKEN = os.environ['GOOGLE_REFRESH_TOKEN']
 
+# ESP32 MQTT buffer limit (leave margin for MQTT overhead)
+MAX_PAYLOAD_SIZE = 1900  # Buffer is 2048, use 1900 to be safe
+
+# How long a built payload is reused by warm invocations
+CACHE_TTL_SECONDS = 300
+
+# Finnish weekday abbreviations, indexed by datetime.weekday()
+DAY_NAMES_SHORT = ('Ma', 'Ti', 'Ke', 'To', 'Pe', 'La', 'Su')
+
 # AWS clients
 iot_client = boto3.client('iot-data', endpoint_url=f'https://{IOT_ENDPOINT}' if IOT_ENDPOINT else None)
 
+# Thread pool for independent network calls, reused across warm invocations
+_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# Google Calendar API service, built lazily and reused across warm invocations
+_SERVICE = None
+
+# Last built payload, reused across warm invocations for CACHE_TTL_SECONDS
+_CACHE = {'ts': 0, 'payload': None, 'payload_bytes': None}
+
 def get_google_credentials():
     """Create Google OAuth credentials from environment variables"""
+    from google.oauth2.credentials import Credentials
+
     try:
         # Validate credentials are present
         if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET or not GOOGLE_REFRESH_TOKEN:
@@ -46,90 +69,117 @@ def get_google_credentials():
         print(f"Error creating Google credentials: {e}")
         raise
 
+def get_calendar_service():
+    """Return the Calendar API service, building it on first use"""
+    global _SERVICE
+    if _SERVICE is None:
+        from google.auth.transport.requests import Request
+        from googleapiclient.discovery import build
+
+        # Fetch the access token up front; afterwards the credentials refresh
+        # it in place whenever it expires
+        creds = get_google_credentials()
+        creds.refresh(Request())
+        _SERVICE = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+    return _SERVICE
+
+# Build the service during Lambda INIT so the first invocation already has a
+# valid access token. On failure it is retried lazily by the handler.
+try:
+    get_calendar_service()
+except Exception as e:
+    print(f"Calendar service warm-up failed, retrying on first invocation: {e}")
+
+def parse_iso_date(value):
+    """Return the date part of an ISO-8601 date or datetime string"""
+    return date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
+def format_day(day):
+    """Format a date as Finnish weekday abbreviation and day.month, e.g. 'Pe 14.11'"""
+    return f"{DAY_NAMES_SHORT[day.weekday()]} {day.day:02d}.{day.month:02d}"
+
+def format_event(event):
+    """Format a Google Calendar event for the ESP32 display"""
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    end = event['end'].get('dateTime', event['end'].get('date'))
+
+    # Google returns strict ISO-8601 ("YYYY-MM-DD" or "YYYY-MM-DDTHH:MM:SS+HH:MM"),
+    # so the local date and time can be sliced out directly
+    start_date = parse_iso_date(start)
+    end_date = parse_iso_date(end)
+
+    if 'T' in start:  # DateTime event
+        # Check if multi-day (different dates)
+        if start_date != end_date:
+            time_str = f"{format_day(start_date)} - {format_day(end_date)}"
+            is_multiday = True
+        else:
+            time_str = f"{format_day(start_date)} {start[11:16]}"
+            is_multiday = False
+    else:  # All-day event
+        # Google Calendar end dates are exclusive (next day), so subtract 1 day
+        end_date = end_date - timedelta(days=1)
+
+        # Check if multi-day
+        if start_date != end_date:
+            time_str = f"{format_day(start_date)} - {format_day(end_date)}"
+            is_multiday = True
+        else:
+            time_str = f"{format_day(start_date)} Koko päivä"
+            is_multiday = False
+
+    return {
+        'title': event.get('summary', 'No Title'),
+        'time': time_str,
+        'date': start,
+        'location': event.get('location', ''),
+        'description': event.get('description', '')[:100],  # Truncate description
+        'all_day': 'T' not in start,
+        'multiday': is_multiday,
+    }
+
 def fetch_calendar_events():
     """Fetch upcoming calendar events from Google Calendar"""
-    try:
-        creds = get_google_credentials()
+    from googleapiclient.errors import HttpError
 
-        # Build Calendar API service
-        service = build('calendar', 'v3', credentials=creds)
+    try:
+        service = get_calendar_service()
 
         # Get events from now to 90 days in the future (3 months)
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         end_time = now + timedelta(days=90)
 
         print(f"Fetching events from {CALENDAR_ID}")
-        print(f"Time range: {now.isoformat()}Z to {end_time.isoformat()}Z")
+        print(f"Time range: {now.isoformat()} to {end_time.isoformat()}")
 
         events_result = service.events().list(
             calendarId=CALENDAR_ID,
-            timeMin=now.isoformat() + 'Z',
-            timeMax=end_time.isoformat() + 'Z',
-            maxResults=50,  # Fetch many events, will trim to fit buffer
+            timeMin=now.isoformat(),
+            timeMax=end_time.isoformat(),
+            maxResults=12,  # Only ~5-10 events ever fit the ESP32 buffer, trimmed below
             singleEvents=True,
-            orderBy='startTime'
+            orderBy='startTime',
+            fields='items(summary,start,end,location,description)'  # Only what the ESP32 uses
         ).execute()
 
         events = events_result.get('items', [])
         print(f"Google Calendar API returned {len(events)} events")
 
         # Log each event for debugging
-        for i, event in enumerate(events):
-            print(f"Event {i+1}: {event.get('summary', 'No Title')} at {event['start']}")
+        if DEBUG:
+            for i, event in enumerate(events):
+                print(f"Event {i+1}: {event.get('summary', 'No Title')} at {event['start']}")
 
         # Note: Access token is auto-refreshed by Google API library in memory
-        # No need to persist it - will refresh on next cold start
+        # and the service is kept for the lifetime of the container
 
         # Format events for ESP32
-        event_list = []
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            end = event['end'].get('dateTime', event['end'].get('date'))
-
-            # Parse datetime - Finnish translations
-            day_names = ['Maanantai', 'Tiistai', 'Keskiviikko', 'Torstai', 'Perjantai', 'Lauantai', 'Sunnuntai']
-            day_names_short = ['Ma', 'Ti', 'Ke', 'To', 'Pe', 'La', 'Su']
-
-            if 'T' in start:  # DateTime event
-                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-
-                # Check if multi-day (different dates)
-                if start_dt.date() != end_dt.date():
-                    time_str = f"{day_names_short[start_dt.weekday()]} {start_dt.strftime('%d.%m')} - {day_names_short[end_dt.weekday()]} {end_dt.strftime('%d.%m')}"
-                    is_multiday = True
-                else:
-                    time_str = f"{day_names_short[start_dt.weekday()]} {start_dt.strftime('%d.%m %H:%M')}"
-                    is_multiday = False
-            else:  # All-day event
-                start_dt = datetime.fromisoformat(start)
-                end_dt = datetime.fromisoformat(end)
-
-                # Google Calendar end dates are exclusive (next day), so subtract 1 day
-                end_dt = end_dt - timedelta(days=1)
-
-                # Check if multi-day
-                if start_dt.date() != end_dt.date():
-                    time_str = f"{day_names_short[start_dt.weekday()]} {start_dt.strftime('%d.%m')} - {day_names_short[end_dt.weekday()]} {end_dt.strftime('%d.%m')}"
-                    is_multiday = True
-                else:
-                    time_str = f"{day_names_short[start_dt.weekday()]} {start_dt.strftime('%d.%m')} Koko päivä"
-                    is_multiday = False
-
-            formatted_event = {
-                'title': event.get('summary', 'No Title'),
-                'time': time_str,
-                'date': start,
-                'location': event.get('location', ''),
-                'description': event.get('description', '')[:100],  # Truncate description
-                'all_day': 'T' not in start,
-                'multiday': is_multiday,
-            }
+        event_list = [format_event(event) for event in events]
 
-            event_list.append(formatted_event)
-
-            # Log full event details
-            print(f"  Formatted event: {formatted_event}")
+        # Log full event details
+        if DEBUG:
+            for formatted_event in event_list:
+                print(f"  Formatted event: {formatted_event}")
 
         return event_list
 
@@ -140,13 +190,21 @@ def fetch_calendar_events():
         print(f"Error fetching calendar events: {e}")
         raise
 
-def publish_to_iot(topic, payload):
-    """Publish data to IoT Core"""
+def encode_payload(data):
+    """Serialize data as compact UTF-8 JSON bytes, exactly as sent to IoT Core.
+
+    Non-ASCII text (e.g. Finnish names) is kept as UTF-8 instead of 6-byte
+    \\uXXXX escapes, so sizes must be measured on these bytes.
+    """
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def publish_to_iot(topic, payload_bytes):
+    """Publish already-serialized payload to IoT Core"""
     try:
         response = iot_client.publish(
             topic=topic,
             qos=1,
-            payload=json.dumps(payload)
+            payload=payload_bytes
         )
         print(f"Published to {topic}")
         return response
@@ -154,21 +212,21 @@ def publish_to_iot(topic, payload):
         print(f"Error publishing to IoT: {e}")
         raise
 
-def update_shadow(payload):
+def update_shadow(payload, timestamp):
     """Update device shadow with calendar data"""
     try:
         shadow_update = {
             "state": {
                 "desired": {
                     "calendar": payload,
-                    "lastUpdated": datetime.utcnow().isoformat()
+                    "lastUpdated": timestamp
                 }
             }
         }
 
         response = iot_client.update_thing_shadow(
             thingName=THING_NAME,
-            payload=json.dumps(shadow_update)
+            payload=encode_payload(shadow_update)
         )
         print(f"Updated shadow for {THING_NAME}")
         return response
@@ -176,99 +234,118 @@ def update_shadow(payload):
         print(f"Error updating shadow: {e}")
         raise
 
-def handler(event, context):
-    """Lambda handler function"""
-    print(f"Calendar Lambda triggered for thing: {THING_NAME}")
-
-    try:
-        # Fetch calendar events
-        events = fetch_calendar_events()
-
-        # ESP32 MQTT buffer limit (leave margin for MQTT overhead)
-        MAX_PAYLOAD_SIZE = 1900  # Buffer is 2048, use 1900 to be safe
+def build_payload(timestamp):
+    """Fetch events and build the ESP32 payload, trimmed to fit its MQTT buffer.
+
+    Returns the payload dict and its encoded bytes.
+    """
+    # Fetch calendar events
+    events = fetch_calendar_events()
+
+    # Build payload and check size, trim if needed
+    payload = {
+        'events': events,
+        'count': len(events),
+        'timestamp': timestamp,
+        'calendar_id': CALENDAR_ID,
+    }
+
+    # Check payload size and trim if necessary
+    # Sizes are measured in bytes of the encoding that is actually published
+    payload_bytes = encode_payload(payload)
+    payload_size = len(payload_bytes)
+
+    if payload_size > MAX_PAYLOAD_SIZE:
+        print(f"⚠️  Payload too large ({payload_size} bytes), trimming to fit buffer...")
+
+        # Strategy: Add events one by one, shortening descriptions if needed.
+        # Track the serialized size incrementally instead of re-dumping the
+        # whole payload for every candidate event.
+        envelope = dict(payload, events=[])
+        # Each event adds its own JSON plus a "," separator (none for the first)
+        total_size = len(encode_payload(envelope)) - 1
+        trimmed_events = []
+
+        for i, evt in enumerate(events):
+            # Try with full description first
+            evt_size = len(encode_payload(evt)) + 1
+
+            if total_size + evt_size <= MAX_PAYLOAD_SIZE:
+                # Fits with full description
+                trimmed_events.append(evt)
+                total_size += evt_size
+                print(f"  ✓ Event {i+1}: '{evt['title']}' (full)")
+            elif evt['description']:
+                # Try with shortened description (50% reduction); only now is a
+                # copy needed, so the original event is left untouched
+                short_evt = dict(evt, description=evt['description'][:50])
+                evt_size = len(encode_payload(short_evt)) + 1
+
+                if total_size + evt_size <= MAX_PAYLOAD_SIZE:
+                    trimmed_events.append(short_evt)
+                    total_size += evt_size
+                    print(f"  ✓ Event {i+1}: '{evt['title']}' (shortened desc)")
+                else:
+                    # Try with no description
+                    short_evt['description'] = ''
+                    evt_size = len(encode_payload(short_evt)) + 1
+
+                    if total_size + evt_size <= MAX_PAYLOAD_SIZE:
+                        trimmed_events.append(short_evt)
+                        total_size += evt_size
+                        print(f"  ✓ Event {i+1}: '{evt['title']}' (no desc)")
+                    else:
+                        print(f"  ✗ Event {i+1}: '{evt['title']}' (would exceed buffer)")
+                        break
+            else:
+                # No description to shorten, can't fit
+                print(f"  ✗ Event {i+1}: '{evt['title']}' (would exceed buffer)")
+                break
 
-        # Build payload and check size, trim if needed
         payload = {
-            'events': events,
-            'count': len(events),
-            'timestamp': datetime.utcnow().isoformat(),
+            'events': trimmed_events,
+            'count': len(trimmed_events),
+            'timestamp': timestamp,
             'calendar_id': CALENDAR_ID,
         }
+        payload_bytes = encode_payload(payload)
+        print(f"✅ Optimized to fit {len(trimmed_events)} events ({len(payload_bytes)} bytes)")
 
-        # Check payload size and trim if necessary
-        payload_json = json.dumps(payload)
-        payload_size = len(payload_json)
-
-        if payload_size > MAX_PAYLOAD_SIZE:
-            print(f"⚠️  Payload too large ({payload_size} bytes), trimming to fit buffer...")
+    return payload, payload_bytes
 
-            # Strategy: Add events one by one, shortening descriptions if needed
-            trimmed_events = []
+def handler(event, context):
+    """Lambda handler function"""
+    print(f"Calendar Lambda triggered for thing: {THING_NAME}")
 
-            for i, evt in enumerate(events):
-                # Try with full description first
-                test_evt = evt.copy()
-                test_payload = {
-                    'events': trimmed_events + [test_evt],
-                    'count': len(trimmed_events) + 1,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'calendar_id': CALENDAR_ID,
-                }
-                test_size = len(json.dumps(test_payload))
-
-                if test_size <= MAX_PAYLOAD_SIZE:
-                    # Fits with full description
-                    trimmed_events.append(test_evt)
-                    print(f"  ✓ Event {i+1}: '{evt['title']}' (full)")
-                elif test_evt['description']:
-                    # Try with shortened description (50% reduction)
-                    test_evt['description'] = test_evt['description'][:50]
-                    test_payload['events'][-1] = test_evt
-                    test_size = len(json.dumps(test_payload))
-
-                    if test_size <= MAX_PAYLOAD_SIZE:
-                        trimmed_events.append(test_evt)
-                        print(f"  ✓ Event {i+1}: '{evt['title']}' (shortened desc)")
-                    else:
-                        # Try with no description
-                        test_evt['description'] = ''
-                        test_payload['events'][-1] = test_evt
-                        test_size = len(json.dumps(test_payload))
-
-                        if test_size <= MAX_PAYLOAD_SIZE:
-                            trimmed_events.append(test_evt)
-                            print(f"  ✓ Event {i+1}: '{evt['title']}' (no desc)")
-                        else:
-                            print(f"  ✗ Event {i+1}: '{evt['title']}' (would exceed buffer)")
-                            break
-                else:
-                    # No description to shorten, can't fit
-                    print(f"  ✗ Event {i+1}: '{evt['title']}' (would exceed buffer)")
-                    break
-
-            payload = {
-                'events': trimmed_events,
-                'count': len(trimmed_events),
-                'timestamp': datetime.utcnow().isoformat(),
-                'calendar_id': CALENDAR_ID,
-            }
-            payload_json = json.dumps(payload)
-            print(f"✅ Optimized to fit {len(trimmed_events)} events ({len(payload_json)} bytes)")
+    try:
+        # Reuse a recently built payload unless the invocation asks for a refresh,
+        # e.g. {"force": true}
+        force = isinstance(event, dict) and bool(event.get('force'))
+        timestamp = datetime.now(timezone.utc).isoformat()
+        now = time.time()
+
+        if not force and _CACHE['payload'] and now - _CACHE['ts'] < CACHE_TTL_SECONDS:
+            print(f"Using cached payload from {int(now - _CACHE['ts'])}s ago")
+            payload, payload_bytes = _CACHE['payload'], _CACHE['payload_bytes']
+        else:
+            payload, payload_bytes = build_payload(timestamp)
+            _CACHE.update(ts=now, payload=payload, payload_bytes=payload_bytes)
 
         # Publish to IoT topic (for immediate delivery if device is connected)
         topic = f"calendar/{THING_NAME}/events"
         print(f"Publishing {len(payload['events'])} events to {topic}")
 
-        # Log full payload
-        payload_json = json.dumps(payload, indent=2)
-        print(f"Full payload to ESP32:\n{payload_json}")
-        print(f"Payload size: {len(payload_json)} bytes")
-
-        # Publish to MQTT topic
-        publish_to_iot(topic, payload)
+        # Log full payload only when debugging, size summary always
+        if DEBUG:
+            print(f"Full payload to ESP32:\n{payload_bytes.decode()}")
+        print(f"Payload size: {len(payload_bytes)} bytes")
 
-        # Also update Device Shadow (persists data for sleeping device)
-        update_shadow(payload)
+        # Publish to MQTT topic and update Device Shadow (persists data for
+        # sleeping device) concurrently - both are independent IoT Core calls
+        publish_future = _EXECUTOR.submit(publish_to_iot, topic, payload_bytes)
+        shadow_future = _EXECUTOR.submit(update_shadow, payload, timestamp)
+        publish_future.result()
+        shadow_future.result()
 
         return {
             'statusCode': 200,
@@ -276,8 +353,8 @@ def handler(event, context):
                 'message': 'Calendar events published successfully',
                 'topic': topic,
                 'event_count': len(payload['events']),
-                'payload_size': len(payload_json),
-            })
+                'payload_size': len(payload_bytes),
+            }, separators=(',', ':'))
         }
 
     except Exception as e:
@@ -286,5 +363,5 @@ def handler(event, context):
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
-            })
+            }, separators=(',', ':'))
         }
@@ -6,28 +6,54 @@ Fetches weather data and forecast from OpenWeatherMap and publishes to IoT Core
 import json
 import os
 import boto3
-import urllib.request
-import urllib.error
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+from datetime import datetime, timezone
 
 # Environment variables
 THING_NAME = os.environ['THING_NAME']
 WEATHER_API_KEY = os.environ['WEATHER_API_KEY']
 WEATHER_CITY = os.environ['WEATHER_CITY']
 IOT_ENDPOINT = os.environ.get('IOT_ENDPOINT', '')
+DEBUG = os.environ.get('LOG_LEVEL') == 'DEBUG'  # Log full payloads
+
+# Finnish date names, indexed by datetime.weekday() and datetime.month
+DAY_NAMES_FI = ('Maanantai', 'Tiistai', 'Keskiviikko', 'Torstai', 'Perjantai', 'Lauantai', 'Sunnuntai')
+MONTH_NAMES_FI = ('', 'Tammikuu', 'Helmikuu', 'Maaliskuu', 'Huhtikuu', 'Toukokuu',
+                  'Kesäkuu', 'Heinäkuu', 'Elokuu', 'Syyskuu', 'Lokakuu', 'Marraskuu', 'Joulukuu')
 
 # AWS clients
 iot_client = boto3.client('iot-data', endpoint_url=f'https://{IOT_ENDPOINT}' if IOT_ENDPOINT else None)
 
+# HTTP connection pool, keeps the OpenWeatherMap connection alive across warm
+# invocations (sized for the two concurrent requests made per invocation).
+# Single attempt with a bounded timeout, like the previous urlopen(timeout=10),
+# so a slow API fails into the handler's error path well within the 30s
+# Lambda timeout instead of retrying until the invocation is killed
+http_pool = urllib3.PoolManager(
+    maxsize=2,
+    retries=False,
+    timeout=urllib3.Timeout(connect=3.0, read=7.0),
+)
+
+# Thread pool for independent network calls, reused across warm invocations
+_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+def fetch_openweathermap(endpoint):
+    """GET an OpenWeatherMap API endpoint and return the decoded JSON"""
+    url = f"https://api.openweathermap.org/data/2.5/{endpoint}"
+    params = {'q': WEATHER_CITY, 'appid': WEATHER_API_KEY, 'units': 'metric'}
+
+    response = http_pool.request('GET', url, fields=params)
+    if response.status != 200:
+        raise urllib3.exceptions.HTTPError(f"OpenWeatherMap returned HTTP {response.status} for {endpoint}")
+
+    return json.loads(response.data)
+
 def fetch_weather():
     """Fetch current weather data from OpenWeatherMap API"""
-    base_url = "http://api.openweathermap.org/data/2.5/weather"
-    params = f"?q={WEATHER_CITY}&appid={WEATHER_API_KEY}&units=metric"
-    url = base_url + params
-
     try:
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode())
+        data = fetch_openweathermap('weather')
 
         weather_data = {
             'temp': int(data['main']['temp']),
@@ -43,7 +69,7 @@ def fetch_weather():
 
         return weather_data
 
-    except urllib.error.URLError as e:
+    except urllib3.exceptions.HTTPError as e:
         print(f"Error fetching weather: {e}")
         raise
     except Exception as e:
@@ -52,13 +78,8 @@ def fetch_weather():
 
 def fetch_forecast():
     """Fetch forecast for next 24 hours from OpenWeatherMap (3-hour intervals)"""
-    base_url = "http://api.openweathermap.org/data/2.5/forecast"
-    params = f"?q={WEATHER_CITY}&appid={WEATHER_API_KEY}&units=metric"
-    url = base_url + params
-
     try:
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode())
+        data = fetch_openweathermap('forecast')
 
         # Get current time
         now = datetime.now(tz=timezone.utc)
@@ -67,23 +88,19 @@ def fetch_forecast():
         forecast_data = []
 
         # We want 4 data points over 24 hours: now, +6h, +12h, +18h
-        target_hours_offset = [0, 6, 12, 18]
-
-        for offset in target_hours_offset:
-            target_time = now + timedelta(hours=offset)
-
-            # Find the closest forecast entry to this target time
-            closest_item = None
-            min_diff = float('inf')
-
-            for item in data['list']:
-                item_time = datetime.fromtimestamp(item['dt'], tz=timezone.utc)
-                time_diff = abs((item_time - target_time).total_seconds())
-
-                if time_diff < min_diff:
-                    min_diff = time_diff
-                    closest_item = item
-
+        # Single pass over the list, comparing raw unix timestamps
+        now_ts = int(now.timestamp())
+        targets = [now_ts + offset * 3600 for offset in (0, 6, 12, 18)]
+        best = [(float('inf'), None)] * len(targets)
+
+        for item in data['list']:
+            item_ts = item['dt']
+            for i, target_ts in enumerate(targets):
+                time_diff = abs(item_ts - target_ts)
+                if time_diff < best[i][0]:
+                    best[i] = (time_diff, item)
+
+        for _, closest_item in best:
             if closest_item:
                 item_time = datetime.fromtimestamp(closest_item['dt'], tz=timezone.utc)
                 forecast_data.append({
@@ -100,42 +117,50 @@ def fetch_forecast():
 
         return forecast_data
 
-    except urllib.error.URLError as e:
+    except urllib3.exceptions.HTTPError as e:
         print(f"Error fetching forecast: {e}")
         return []
     except Exception as e:
         print(f"Error parsing forecast data: {e}")
         return []
 
-def publish_to_iot(topic, payload):
-    """Publish data to IoT Core"""
+def encode_payload(data):
+    """Serialize data as compact UTF-8 JSON bytes, exactly as sent to IoT Core.
+
+    Non-ASCII text (e.g. Finnish names) is kept as UTF-8 instead of 6-byte
+    \\uXXXX escapes, so sizes must be measured on these bytes.
+    """
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def publish_to_iot(topic, payload_bytes):
+    """Publish already-serialized payload to IoT Core"""
     try:
         response = iot_client.publish(
             topic=topic,
             qos=1,
-            payload=json.dumps(payload)
+            payload=payload_bytes
         )
-        print(f"Published to {topic}: {json.dumps(payload)}")
+        print(f"Published to {topic}")
         return response
     except Exception as e:
         print(f"Error publishing to IoT: {e}")
         raise
 
-def update_shadow(payload):
+def update_shadow(payload, timestamp):
     """Update device shadow with weather data"""
     try:
         shadow_update = {
             "state": {
                 "desired": {
                     "weather": payload,
-                    "lastUpdated": datetime.utcnow().isoformat()
+                    "lastUpdated": timestamp
                 }
             }
         }
 
         response = iot_client.update_thing_shadow(
             thingName=THING_NAME,
-            payload=json.dumps(shadow_update)
+            payload=encode_payload(shadow_update)
         )
         print(f"Updated shadow for {THING_NAME}")
         return response
@@ -148,20 +173,19 @@ def handler(event, context):
     print(f"Weather Lambda triggered for thing: {THING_NAME}")
 
     try:
-        # Fetch current weather and forecast
-        weather = fetch_weather()
-        forecast = fetch_forecast()
+        # Fetch current weather and forecast concurrently (independent API calls)
+        weather_future = _EXECUTOR.submit(fetch_weather)
+        forecast_future = _EXECUTOR.submit(fetch_forecast)
+        weather = weather_future.result()
+        forecast = forecast_future.result()
 
         # Get current date/time
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
+        timestamp = now.isoformat()
 
         # Finnish date formatting
-        day_names_fi = ['Maanantai', 'Tiistai', 'Keskiviikko', 'Torstai', 'Perjantai', 'Lauantai', 'Sunnuntai']
-        month_names_fi = ['', 'Tammikuu', 'Helmikuu', 'Maaliskuu', 'Huhtikuu', 'Toukokuu',
-                          'Kesäkuu', 'Heinäkuu', 'Elokuu', 'Syyskuu', 'Lokakuu', 'Marraskuu', 'Joulukuu']
-
-        day_name = day_names_fi[now.weekday()]
-        month_name = month_names_fi[now.month]
+        day_name = DAY_NAMES_FI[now.weekday()]
+        month_name = MONTH_NAMES_FI[now.month]
         date_str = f"{day_name} {now.day} {month_name}"
 
         # Add metadata
@@ -169,7 +193,7 @@ def handler(event, context):
             'current': weather,
             'forecast': forecast,
             'date': date_str,  # e.g., "Perjantai 14 Marraskuu"
-            'timestamp': now.isoformat(),
+            'timestamp': timestamp,
             'source': 'openweathermap',
             'city': WEATHER_CITY,
         }
@@ -177,16 +201,18 @@ def handler(event, context):
         # Publish to IoT topic (for immediate delivery if device is connected)
         topic = f"calendar/{THING_NAME}/weather"
 
-        # Log full payload
-        payload_json = json.dumps(payload, indent=2)
-        print(f"Full payload to ESP32:\n{payload_json}")
-        print(f"Payload size: {len(payload_json)} bytes")
-
-        # Publish to MQTT topic
-        publish_to_iot(topic, payload)
+        # Log full payload only when debugging, size summary always
+        payload_bytes = encode_payload(payload)
+        if DEBUG:
+            print(f"Full payload to ESP32:\n{payload_bytes.decode()}")
+        print(f"Payload size: {len(payload_bytes)} bytes")
 
-        # Also update Device Shadow (persists data for sleeping device)
-        update_shadow(payload)
+        # Publish to MQTT topic and update Device Shadow (persists data for
+        # sleeping device) concurrently - both are independent IoT Core calls
+        publish_future = _EXECUTOR.submit(publish_to_iot, topic, payload_bytes)
+        shadow_future = _EXECUTOR.submit(update_shadow, payload, timestamp)
+        publish_future.result()
+        shadow_future.result()
 
         return {
             'statusCode': 200,
@@ -195,7 +221,7 @@ def handler(event, context):
                 'topic': topic,
                 'temperature': weather['temp'],
                 'forecast_count': len(forecast),
-            })
+            }, separators=(',', ':'))
         }
 
     except Exception as e:
@@ -204,5 +230,5 @@ def handler(event, context):
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
-            })
+            }, separators=(',', ':'))
         }
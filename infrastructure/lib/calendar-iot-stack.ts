@@ -101,6 +101,7 @@ export class CalendarIotStack extends cdk.Stack {
         WEATHER_API_KEY: process.env.WEATHER_API_KEY || '',
         WEATHER_CITY: process.env.WEATHER_CITY || '',
         IOT_ENDPOINT: iotEndpoint,
+        LOG_LEVEL: process.env.LOG_LEVEL || 'INFO',
       },
       logRetention: logs.RetentionDays.ONE_WEEK,
       deadLetterQueue: weatherDLQ,
@@ -135,6 +136,7 @@ export class CalendarIotStack extends cdk.Stack {
         GOOGLE_CLIENT_ID: process.env.GOOGLE_CLIENT_ID || '',
         GOOGLE_CLIENT_SECRET: process.env.GOOGLE_CLIENT_SECRET || '',
         GOOGLE_REFRESH_TOKEN: process.env.GOOGLE_REFRESH_TOKEN || '',
+        LOG_LEVEL: process.env.LOG_LEVEL || 'INFO',
       },
       logRetention: logs.RetentionDays.ONE_WEEK,
       deadLetterQueue: calendarDLQ,
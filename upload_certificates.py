@@ -10,18 +10,17 @@ Usage:
   3. Run: python3 upload_certificates.py /dev/ttyUSB0
 
 Prerequisites:
-  pip install esptool pyserial
-
-  Download mklittlefs from:
-  https://github.com/earlephilhower/mklittlefs/releases
-  and add to PATH
+  pip install esptool pyserial "littlefs-python>=0.10"
 """
 
 import os
 import sys
 import subprocess
-import glob
+import shutil
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 import serial.tools.list_ports
+from littlefs import LittleFS
 
 def find_esp32_port():
     """Auto-detect ESP32 port"""
@@ -35,7 +34,6 @@ def check_tools():
     """Check if required tools are installed"""
     tools = {
         "esptool.py": "pip install esptool",
-        "mklittlefs": "Download from: https://github.com/earlephilhower/mklittlefs/releases"
     }
 
     missing = []
@@ -56,25 +54,39 @@ def create_littlefs_image(data_dir="eink-calendar/data", output="littlefs.bin"):
     """Create LittleFS image from data directory"""
     # ESP32 4MB flash default partition (matches partition table at 0x290000)
     # Size is 0x160000 (1,441,792 bytes = 1.375 MB)
-    fs_size = str(0x160000)  # Must match partition size exactly
-    block_size = "4096"
-    page_size = "256"
-
-    cmd = [
-        "mklittlefs",
-        "-c", data_dir,
-        "-b", block_size,
-        "-p", page_size,
-        "-s", fs_size,
-        output
-    ]
+    fs_size = 0x160000  # Must match partition size exactly
+    block_size = 4096
+    page_size = 256
 
     print(f"\n📦 Creating LittleFS image from {data_dir}/...")
-    print(f"   Size: {int(fs_size)/1024/1024:.2f} MB")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-
-    if result.returncode != 0:
-        print(f"❌ Error: {result.stderr}")
+    print(f"   Size: {fs_size/1024/1024:.2f} MB")
+
+    try:
+        # Same geometry and on-disk format as `mklittlefs -b 4096 -p 256`, built
+        # in memory. Newer littlefs defaults to disk version 2.1, which older
+        # ESP32 cores can't mount (and LittleFS.begin(true) then reformats)
+        fs = LittleFS(
+            block_size=block_size,
+            block_count=fs_size // block_size,
+            read_size=page_size,
+            prog_size=page_size,
+            name_max=32,
+            disk_version=0x00020000,
+        )
+
+        for root, dirs, files in os.walk(data_dir):
+            rel_root = os.path.relpath(root, data_dir).replace(os.sep, "/")
+            fs_root = "" if rel_root == "." else rel_root
+            for name in dirs:
+                fs.makedirs(f"{fs_root}/{name}", exist_ok=True)
+            for name in files:
+                with open(os.path.join(root, name), "rb") as src, fs.open(f"{fs_root}/{name}", "wb") as dest:
+                    dest.write(src.read())
+
+        with open(output, "wb") as f:
+            f.write(fs.context.buffer)
+    except Exception as e:
+        print(f"❌ Error: {e}")
         return False
 
     print(f"✅ LittleFS image created: {output}")
@@ -119,31 +131,34 @@ def organize_certificates(cert_dir):
 
     found = {}
 
+    # List the directory once and match names in memory
+    with os.scandir(cert_dir) as it:
+        entries = {entry.name for entry in it if entry.is_file()}
+
     # Find certificates
     for target, possible_names in cert_files.items():
         for name_pattern in possible_names:
             if "*" in name_pattern:
                 # Handle wildcard patterns
-                matches = glob.glob(os.path.join(cert_dir, name_pattern))
+                matches = sorted(fnmatch.filter(entries, name_pattern))
                 if matches:
-                    source = matches[0]
-                    if os.path.exists(source):
-                        found[target] = source
-                        break
-            else:
-                source = os.path.join(cert_dir, name_pattern)
-                if os.path.exists(source):
-                    found[target] = source
+                    found[target] = os.path.join(cert_dir, matches[0])
                     break
+            elif name_pattern in entries:
+                found[target] = os.path.join(cert_dir, name_pattern)
+                break
 
-    # Copy certificates to data directory
-    for target, source in found.items():
-        dest = os.path.join(data_dir, target)
-        with open(source, 'r') as f:
-            content = f.read()
-        with open(dest, 'w') as f:
-            f.write(content)
-        print(f"✅ Copied {os.path.basename(source)} → {target}")
+    # Copy certificates to data directory, overlapping I/O on slow storage.
+    # Files are copied as opaque bytes (no decode/re-encode or newline translation)
+    def copy_certificate(item):
+        target, source = item
+        shutil.copyfile(source, os.path.join(data_dir, target))
+        return target, source
+
+    if found:
+        with ThreadPoolExecutor(max_workers=len(found)) as executor:
+            for target, source in executor.map(copy_certificate, found.items()):
+                print(f"✅ Copied {os.path.basename(source)} → {target}")
 
     # Check if all required certificates are present
     missing = []